@@ -1,267 +1,378 @@
-import itertools
-import json
+import os
 import subprocess
 import sys
-from collections.abc import Iterable
+import tempfile
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Mapping
+from collections.abc import Set as AbstractSet
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Annotated, Optional
+from typing import Annotated, Optional, TypeVar
 
-import more_itertools
 import typer
-from mdutils.mdutils import MdUtils
-from packaging.version import Version
-from tabulate import tabulate
-
-from adopt_ruff.models.ruff_config import RuffConfig
-from adopt_ruff.models.ruff_output import Violation
-from adopt_ruff.models.rule import FixAvailability, Rule
-from adopt_ruff.utils import ARTIFACTS_PATH, logger, output_table, search_config_file
-
-
-def run_ruff(path: Path) -> tuple[set[Rule], tuple[Violation, ...], Version]:
+from pydantic import TypeAdapter
+from pydantic_core import from_json
+
+from adopt_ruff.models.ruff_config import RuffConfig, find_extended_config_files
+from adopt_ruff.models.ruff_output import RawViolation, Violation
+from adopt_ruff.models.rule import FIXABLE, FixAvailability, Rule
+from adopt_ruff.utils import (
+    ARTIFACTS_PATH,
+    CACHE_PATH,
+    WRITE_BUFFER_SIZE,
+    find_config_files,
+    fingerprint,
+    logger,
+    md_header,
+    md_line,
+    md_table,
+    output_table,
+    search_config_file,
+    user_config_files,
+)
+
+# Built once, so the validation schema isn't recompiled per call
+_RULES_ADAPTER = TypeAdapter(tuple[Rule, ...])
+_VIOLATIONS_ADAPTER = TypeAdapter(tuple[Violation, ...])
+
+_T = TypeVar("_T")
+
+
+def run_ruff(
+    path: Path,
+    refresh_cache: bool = False,
+) -> tuple[dict[str, Rule], tuple[RawViolation, ...], str]:
     try:
-        ruff_version = Version(
-            subprocess.run(
-                ["ruff", "--version"],
-                check=True,
-                text=True,
-                capture_output=True,
-            ).stdout.split()[1]  # ruff's output is `ruff x.y.z`
-        )
+        # only shown in the report, so it's not parsed into a Version
+        ruff_version = subprocess.run(
+            ["ruff", "--version"],
+            check=True,
+            text=True,
+            capture_output=True,
+        ).stdout.split()[1]  # ruff's output is `ruff x.y.z`
         logger.debug(f"parsed {ruff_version=!s}")
 
     except FileNotFoundError:
         logger.error("Make sure ruff is installed (pip install ruff)")
         sys.exit(1)
 
-    # Now when ruff is found, assume the following commands will run properly
-    rules = {
-        Rule(**value)
-        for value in json.loads(
-            subprocess.run(
-                ["ruff", "rule", "--all", "--output-format=json"],
-                check=True,
-                text=True,
-                capture_output=True,
-            ).stdout
+    # Now when ruff is found, assume the following commands will run properly.
+    # They're independent, so the (slow) check runs while the rules are listed.
+    # Their output is kept as bytes, and parsed straight from JSON.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        rules_future = executor.submit(
+            _run_cached,
+            ["ruff", "rule", "--all", "--output-format=json"],
+            name="rules",
+            key=ruff_version,  # rules only change between ruff versions
+            parse=_parse_rules,
+            refresh=refresh_cache,
         )
+        violations_future = executor.submit(_check, path, ruff_version, refresh_cache)
+
+        code_to_rule = rules_future.result()
+        logger.debug(f"read {len(code_to_rule)} rules from JSON output")
+        violations = violations_future.result()
+
+    logger.debug(f"read {len(violations)} violations from JSON output")
+    return code_to_rule, violations, ruff_version
+
+
+def _parse_rules(output: bytes) -> dict[str, Rule]:
+    # sorted once here, filtering the rules later on preserves the order
+    return {
+        rule.code: rule
+        for rule in sorted(_RULES_ADAPTER.validate_json(output), key=attrgetter("code"))
     }
-    logger.debug(f"read {len(rules)} rules from JSON output")
 
-    violations = tuple(
-        Violation(**value)
-        for value in json.loads(
-            subprocess.run(
-                [
-                    *["ruff" if ruff_version < Version("0.3.0") else "ruff", "check"],
-                    str(path),
-                    "--output-format=json",
-                    "--select=ALL",
-                    "--exit-zero",
-                ],
-                check=True,
-                text=True,
-                capture_output=True,
-            ).stdout
-        )
+
+def _parse_violations(output: bytes) -> tuple[RawViolation, ...]:
+    # Most violations are only counted, so they're validated lazily (see map_rules_to_violations)
+    return tuple(from_json(output))
+
+
+def _check(path: Path, ruff_version: str, refresh: bool) -> tuple[RawViolation, ...]:
+    """
+    Runs `ruff check` on the path, reusing the output of a previous run if no relevant file has changed
+    """
+    # The files ruff checks, after applying its include/exclude settings and .gitignore
+    checked_files = [
+        Path(os.fsdecode(line))
+        for line in _run_command(
+            ["ruff", "check", str(path), "--show-files"]
+        ).splitlines()
+    ]
+    config_files = [
+        *find_config_files({path, *(file.parent for file in checked_files)}),
+        *user_config_files(),  # used when a project has no config
+    ]
+
+    return _run_cached(
+        [
+            "ruff",
+            "check",
+            str(path),
+            "--output-format=json",
+            "--select=ALL",
+            "--exit-zero",
+            # ruff's own per-file cache, kept with ours rather than in the checked repo.
+            # When the output cache misses, unchanged files are still skipped by ruff.
+            f"--cache-dir={CACHE_PATH / 'ruff'}",
+        ],
+        name="violations",
+        key=fingerprint(
+            chain(
+                checked_files,
+                config_files,
+                find_extended_config_files(config_files),
+            ),
+            ruff_version,
+        ),
+        parse=_parse_violations,
+        refresh=refresh,
     )
-    logger.debug(f"read {len(violations)} violations from JSON output")
-    return rules, violations, ruff_version
+
+
+def _run_cached(
+    command: list[str],
+    name: str,
+    key: str,
+    parse: Callable[[bytes], _T],
+    refresh: bool = False,
+) -> _T:
+    """
+    Runs the command and parses its output, unless it's already cached under the same name and key
+    (and refresh is off). A cached output that fails to parse is treated as a miss.
+    Only the latest output is kept per name.
+    """
+    cache_file = CACHE_PATH / f"{name}-{key}.json"
+    if not refresh and cache_file.exists():
+        try:
+            parsed = parse(cache_file.read_bytes())
+        except ValueError:
+            logger.warning(f"ignoring unreadable cached {name} at {cache_file!s}")
+        else:
+            logger.debug(f"using cached {name} from {cache_file!s}")
+            return parsed
+
+    output = _run_command(command)
+    parsed = parse(output)  # before caching, so unparsable output isn't kept
+
+    CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    # written aside and then moved into place, so an interrupted run can't leave a partial file
+    with tempfile.NamedTemporaryFile(
+        dir=CACHE_PATH, prefix=f"{name}-", suffix=".tmp", delete=False
+    ) as temp_file:
+        temp_file.write(output)
+    Path(temp_file.name).replace(cache_file)
+
+    for stale_cache_file in CACHE_PATH.glob(f"{name}-*.json"):
+        if stale_cache_file != cache_file:
+            stale_cache_file.unlink()
+    return parsed
+
+
+def _run_command(command: list[str]) -> bytes:
+    return subprocess.run(
+        command,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,  # not used, no need to buffer it
+    ).stdout
 
 
 def run(
-    rules: set[Rule],
-    violations: tuple[Violation, ...],
+    code_to_rule: Mapping[str, Rule],
+    violations: tuple[RawViolation, ...],
     config: RuffConfig,
-    ruff_version: Version,
+    ruff_version: str,
     include_sometimes_fixable: bool,
     include_preview: bool,
     repo_name: str | None = None,
 ) -> str:
-    md = MdUtils("output")
+    md: list[str] = []  # joined once at the end
 
     repo_name_header = f"for {repo_name} " if repo_name else ""
-    md.new_header(1, f"adopt-ruff report {repo_name_header}(ruff {ruff_version!s})")
+    md.append(
+        md_header(1, f"adopt-ruff report {repo_name_header}(ruff {ruff_version!s})")
+    )
 
-    configured_rules = config.all_rules
+    configured_codes = frozenset(rule.code for rule in config.all_rules)
 
-    if respected := sorted(
-        respected_rules(
-            violations,
-            rules,
-            configured_rules,
-            include_preview,
-        ),
-        key=lambda rule: rule.code,
-    ):
-        md.new_header(2, "Respected Ruff rules")
-        md.new_line(
-            f"{len(respected)} Ruff rules are already respected in the repo - "
-            "they can be added right away 🚀"
-        )
-        output_table(
-            items=([r.as_dict() for r in respected]),
-            path=ARTIFACTS_PATH / "respected.csv",
-            md=md,
-            collapsible=True,
-        )
+    code_to_violations = group_violations_by_code(violations)
 
-    if autofixable := sort_by_code(
-        autofixable_rules(
-            violations,
-            rules,
-            configured_rules,
-            include_sometimes_fixable,
-            include_preview,
-        )
-    ):
-        md.new_header(2, "Autofixable Ruff rules")
-        always_status = " (sometimes)" if include_sometimes_fixable else ""
-        md.new_line(
-            f"{len(autofixable)} Ruff rules are violated in the repo, but can{always_status} be auto-fixed 🪄"
-        )
-        output_table(
-            items=([r.as_dict() for r in autofixable]),
-            path=ARTIFACTS_PATH / "autofixable.csv",
-            md=md,
-            collapsible=True,
-        )
+    respected, autofixable, violated = classify_rules(
+        code_to_rule.values(),
+        violated_codes=code_to_violations.keys(),
+        configured_codes=configured_codes,
+        include_sometimes_fixable=include_sometimes_fixable,
+        include_preview=include_preview,
+    )
 
-    if violated_rule_to_violations := (
-        violated_rules(
-            violations,
-            rules,
-            excluded_rules=(
-                itertools.chain.from_iterable(
-                    (configured_rules, respected, autofixable)
+    # CSV artifacts are written in the background, while the markdown is built
+    csv_writes: list[Future[None]] = []
+    with ThreadPoolExecutor(thread_name_prefix="csv-writer") as csv_writer:
+        if respected:
+            md.append(md_header(2, "Respected Ruff rules"))
+            md.append(
+                md_line(
+                    f"{len(respected)} Ruff rules are already respected in the repo - "
+                    "they can be added right away 🚀"
                 )
-            ),
-            include_preview=include_preview,
-        )
-    ):
-        rule_to_violation_count = {
-            rule: len(violations_)
-            for rule, violations_ in violated_rule_to_violations.items()
-        }
-
-        applicable_rules = sorted(
-            violated_rule_to_violations.keys(),
-            key=lambda rule: (rule_to_violation_count[rule], rule.linter, rule.code),
-        )
+            )
+            csv_writes.append(
+                output_table(
+                    items=([r.as_dict for r in respected]),
+                    path=ARTIFACTS_PATH / "respected.csv",
+                    md=md,
+                    csv_writer=csv_writer,
+                    collapsible=True,
+                )
+            )
 
-        md.new_header(2, "Applicable Rules")
-        md.new_line(
-            f"{len(applicable_rules)} other Ruff rules are not yet configured in the repository"
-        )
-        output_table(
-            items=(
-                [
-                    r.as_dict() | {"Violations": rule_to_violation_count[r]}
-                    for r in applicable_rules
-                ]
-            ),
-            path=ARTIFACTS_PATH / "applicable.csv",
-            md=md,
-            collapsible=True,
-        )
+        if autofixable:
+            md.append(md_header(2, "Autofixable Ruff rules"))
+            always_status = " (sometimes)" if include_sometimes_fixable else ""
+            md.append(
+                md_line(
+                    f"{len(autofixable)} Ruff rules are violated in the repo, but can{always_status} be auto-fixed 🪄"
+                )
+            )
+            csv_writes.append(
+                output_table(
+                    items=([r.as_dict for r in autofixable]),
+                    path=ARTIFACTS_PATH / "autofixable.csv",
+                    md=md,
+                    csv_writer=csv_writer,
+                    collapsible=True,
+                )
+            )
+
+        if violated_rule_to_violations := map_rules_to_violations(
+            violated, code_to_violations
+        ):
+            # sort on precomputed (violation count, linter, code) keys, reused for the rows below
+            keyed_applicable_rules = sorted(
+                (
+                    ((len(violations_), rule.linter, rule.code), rule)
+                    for rule, violations_ in violated_rule_to_violations.items()
+                ),
+                key=itemgetter(0),
+            )
+
+            md.append(md_header(2, "Applicable Rules"))
+            md.append(
+                md_line(
+                    f"{len(keyed_applicable_rules)} other Ruff rules are not yet configured in the repository"
+                )
+            )
+            csv_writes.append(
+                output_table(
+                    items=(
+                        [
+                            rule.as_dict | {"Violations": violation_count}
+                            for (violation_count, _, _), rule in keyed_applicable_rules
+                        ]
+                    ),
+                    path=ARTIFACTS_PATH / "applicable.csv",
+                    md=md,
+                    csv_writer=csv_writer,
+                    collapsible=True,
+                )
+            )
+
+    for csv_write in csv_writes:
+        csv_write.result()  # re-raises errors from the writing threads
 
     if not any((respected, autofixable, violated_rule_to_violations)):
-        md.new_line(
-            f"You adopted Ruff well! 👏 {len(rules)} ruff rules are either selected or ignored."
+        md.append(
+            md_line(
+                f"You adopted Ruff well! 👏 {len(code_to_rule)} ruff rules are either selected or ignored."
+            )
         )
         if not include_preview:
-            md.new_line(
-                "You used --no-preview, ignoring rules in preview-mode.\n"
-                "Consider running adopt-ruff again with the `--preview` flag: there may be more useful rules there 🔍\n"
-                "Visit ⚡[Ruff's docs](https://docs.astral.sh/ruff/faq/#what-is-preview) for more information."
+            md.append(
+                md_line(
+                    "You used --no-preview, ignoring rules in preview-mode.\n"
+                    "Consider running adopt-ruff again with the `--preview` flag: there may be more useful rules there 🔍\n"
+                    "Visit ⚡[Ruff's docs](https://docs.astral.sh/ruff/faq/#what-is-preview) for more information."
+                )
             )
         elif not include_sometimes_fixable:
-            md.new_line(
-                "Consider running adopt-ruff again with the `--sometimes-fixable flag`"
+            md.append(
+                md_line(
+                    "Consider running adopt-ruff again with the `--sometimes-fixable flag`"
+                )
             )
 
-    md.new_line(
-        tabulate(
-            [
-                ["Include sometimes-fixable rules", include_sometimes_fixable],
-                ["Include preview rules", include_preview],
-            ],
-            tablefmt="github",
-            headers=["Configuration", "Value"],
+    md.append(
+        md_line(
+            md_table(
+                ["Configuration", "Value"],
+                [
+                    ["Include sometimes-fixable rules", include_sometimes_fixable],
+                    ["Include preview rules", include_preview],
+                ],
+            )
         )
     )
-    return md.get_md_text()
-
+    return "".join(md)
 
-def sort_by_code(rules: Iterable[Rule]) -> list[Rule]:
-    return sorted(rules, key=lambda rule: rule.code)
 
-
-def respected_rules(
-    violations: tuple[Violation, ...],
+def classify_rules(
     rules: Iterable[Rule],
-    configured_rules: set[Rule],
-    include_preview: bool,
-) -> set[Rule]:
-    violated_codes = {v.code for v in violations}
-
-    return {
-        rule
-        for rule in rules
-        if (rule.code not in violated_codes)
-        and (rule not in configured_rules)
-        and (include_preview or (not rule.preview))
-    }
-
-
-def autofixable_rules(
-    violations: tuple[Violation, ...],
-    rules: Iterable[Rule],
-    configured_rules: set[Rule],
+    violated_codes: AbstractSet[str],
+    configured_codes: AbstractSet[str],
     include_sometimes_fixable: bool = False,
     include_preview: bool = False,
-) -> set[Rule]:
-    violated_codes = {v.code for v in violations}
+) -> tuple[list[Rule], list[Rule], list[Rule]]:
+    """
+    Splits the rules that aren't configured into respected, autofixable and (other) violated ones,
+    in a single pass. The order of `rules` is preserved within each category.
+    """
+    allowed_fixes = (
+        FIXABLE if include_sometimes_fixable else frozenset({FixAvailability.ALWAYS})
+    )
 
-    return {
-        rule
-        for rule in rules
-        if rule.code in violated_codes
-        and rule not in configured_rules
-        and rule.is_fixable
-        and (not rule.preview if not include_preview else True)
-        and (
-            rule.fix == FixAvailability.ALWAYS
-            if not include_sometimes_fixable
-            else True
-        )
-    }
+    respected: list[Rule] = []
+    autofixable: list[Rule] = []
+    violated: list[Rule] = []
 
+    for rule in rules:
+        if (rule.code in configured_codes) or (rule.preview and not include_preview):
+            continue
+        if rule.code not in violated_codes:
+            respected.append(rule)
+        elif rule.fix in allowed_fixes:  # only fixable availabilities are allowed
+            autofixable.append(rule)
+        else:
+            violated.append(rule)
+
+    return respected, autofixable, violated
 
-def violated_rules(
-    violations: tuple[Violation, ...],
-    rules: set[Rule],
-    excluded_rules: Iterable[Rule],
-    include_preview: bool,
-) -> dict[Rule, tuple[Violation, ...]]:
-    ignore_codes = {rule.code for rule in excluded_rules}
-    return {
-        rule: violations
-        for rule, violations in map_rules_to_violations(rules, violations).items()
-        if (rule.code not in ignore_codes) and (include_preview or (not rule.preview))
-    }
+
+def group_violations_by_code(
+    violations: Iterable[RawViolation],
+) -> dict[str, list[RawViolation]]:
+    code_to_violations: defaultdict[str, list[RawViolation]] = defaultdict(list)
+    for violation in violations:
+        code_to_violations[violation["code"]].append(violation)
+    return code_to_violations
 
 
 def map_rules_to_violations(
     rules: Iterable[Rule],
-    violations: Iterable[Violation],
+    code_to_violations: Mapping[str, list[RawViolation]],
 ) -> dict[Rule, tuple[Violation, ...]]:
-    code_to_violations = more_itertools.bucket(violations, key=lambda v: v.code)
-    code_to_rule = {rule.code: rule for rule in rules}
-
+    """
+    Validates the violations of the given rules only, violations of other codes are dropped
+    """
     return {
-        code_to_rule[code]: tuple(code_to_violations[code])
-        for code in code_to_violations
+        rule: _VIOLATIONS_ADAPTER.validate_python(code_to_violations[rule.code])
+        for rule in rules
+        if rule.code in code_to_violations
     }
 
 
@@ -312,21 +423,36 @@ def _main(
             envvar="ADOPT_RUFF_REPO_NAME",
         ),
     ] = None,
+    refresh_cache: Annotated[
+        bool,
+        typer.Option(
+            "--refresh-cache",
+            help="run ruff even if its output is cached from a previous run",
+            envvar="ADOPT_RUFF_REFRESH_CACHE",
+            is_flag=True,
+        ),
+    ] = False,
 ):
+    ARTIFACTS_PATH.mkdir(exist_ok=True)
+    logger.add((ARTIFACTS_PATH / "adopt-ruff.log"), level="DEBUG")
+
     logger.debug(f"{code_path.resolve()=!s}")
     logger.debug(f"{ruff_conf_path=!s}")
     logger.debug(f"{include_preview=}")
     logger.debug(f"{include_sometimes_fixable=}")
     logger.debug(f"{repo_name=}")
+    logger.debug(f"{refresh_cache=}")
 
-    rules, violations, ruff_version = run_ruff(code_path)
+    code_to_rule, violations, ruff_version = run_ruff(
+        code_path, refresh_cache=refresh_cache
+    )
     config: RuffConfig = RuffConfig.from_file(
         path=ruff_conf_path or search_config_file(code_path),
-        rules=rules,
+        code_to_rule=code_to_rule,
     )
 
     result = run(
-        rules=rules,
+        code_to_rule=code_to_rule,
         violations=violations,
         config=config,
         ruff_version=ruff_version,
@@ -335,7 +461,8 @@ def _main(
         repo_name=repo_name,
     )
 
-    Path("result.md").write_text(result)
+    with Path("result.md").open("w", buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(result)
     logger.debug("wrote output to result.md")
 
 
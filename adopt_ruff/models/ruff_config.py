@@ -1,14 +1,59 @@
+import os
 import tomllib
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from functools import cached_property
 from pathlib import Path
+from typing import Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from adopt_ruff.models.rule import Rule
-from adopt_ruff.utils import logger
+from adopt_ruff.utils import extract_category_prefix, logger
 
 MIN_RULE_CODE_LEN = 4
 DEFAULT_SELECT_RULES = ("E", "F")
 
+# config file name -> the ruff section of its parsed TOML (None if missing)
+_CONFIG_FILE_RUFF_SECTION: dict[str, Callable[[dict[str, Any]], Any]] = {
+    "pyproject.toml": lambda toml: toml.get("tool", {}).get("ruff"),
+    "ruff.toml": lambda toml: toml,
+    ".ruff.toml": lambda toml: toml,
+}
+
+
+def find_extended_config_files(config_files: Iterable[Path]) -> Iterator[Path]:
+    """
+    Yields the files that the existing `config_files` pull in with `extend`, recursively.
+    """
+    pending = list(config_files)
+    seen: set[Path] = set()
+    while pending:
+        config_file = pending.pop()
+        try:
+            with config_file.open("rb") as f:
+                toml = tomllib.load(f)
+        except (OSError, ValueError):  # missing or invalid, ruff reports the latter
+            continue
+
+        # extended files can have any name, those not named like a config are read as ruff.toml
+        get_ruff_section = _CONFIG_FILE_RUFF_SECTION.get(
+            config_file.name, _CONFIG_FILE_RUFF_SECTION["ruff.toml"]
+        )
+        ruff_section = get_ruff_section(toml)
+        if not isinstance(ruff_section, dict) or not isinstance(
+            extend := ruff_section.get("extend"), str
+        ):
+            continue
+
+        extended = (
+            config_file.parent / Path(os.path.expandvars(extend)).expanduser()
+        ).resolve()
+        if extended not in seen:
+            seen.add(extended)
+            pending.append(extended)
+            yield extended
+
 
 class RawRuffConfig(BaseModel):
     selected_codes: set[str]
@@ -16,25 +61,22 @@ class RawRuffConfig(BaseModel):
 
     @classmethod
     def read_toml(cls, path: Path) -> "RawRuffConfig":
+        if (get_ruff_section := _CONFIG_FILE_RUFF_SECTION.get(path.name)) is None:
+            raise ValueError(
+                f"config file must be pyproject.toml, ruff.toml or .ruff.toml, got {path.name}"
+            )
+
         try:
-            toml = tomllib.loads(path.read_text())
+            with path.open("rb") as f:
+                toml = tomllib.load(f)
         except ValueError as e:
             raise ValueError(f"make sure that {path.name} is a valid toml") from e
 
-        match path.name:
-            case "pyproject.toml":
-                if (ruff_section := toml.get("tool", {}).get("ruff")) is None:
-                    logger.warning(
-                        f"could not find `tool` or `tool.ruff` in {path.name}, using default"
-                    )
-                    return cls.default_config()
-
-            case "ruff.toml" | ".ruff.toml":
-                ruff_section = toml
-            case _:
-                raise ValueError(
-                    f"config file must be pyproject.toml, ruff.toml or .ruff.toml, got {path.name}"
-                )
+        if (ruff_section := get_ruff_section(toml)) is None:
+            logger.warning(
+                f"could not find `tool` or `tool.ruff` in {path.name}, using default"
+            )
+            return cls.default_config()
 
         ruff_lint_section = ruff_section.get(
             "lint", ruff_section
@@ -58,11 +100,13 @@ class RawRuffConfig(BaseModel):
 
 
 class RuffConfig(BaseModel):
-    selected_rules: set[Rule]
-    ignored_rules: set[Rule]
+    model_config = ConfigDict(frozen=True)
+
+    selected_rules: frozenset[Rule]
+    ignored_rules: frozenset[Rule]
 
     @staticmethod
-    def from_file(path: Path | None, rules: set[Rule]) -> "RuffConfig":
+    def from_file(path: Path | None, code_to_rule: Mapping[str, Rule]) -> "RuffConfig":
         if path:
             logger.debug(f"reading ruff config file from {path!s}")
             raw_config = RawRuffConfig.read_toml(path)
@@ -72,31 +116,51 @@ class RuffConfig(BaseModel):
             )
             raw_config = RawRuffConfig.default_config()
 
+        category_to_rules = _group_by_category(code_to_rule)
+
         return RuffConfig(
-            selected_rules=_parse_raw_rules(raw_config.selected_codes, rules),
-            ignored_rules=_parse_raw_rules(raw_config.ignored_codes, rules),
+            selected_rules=_parse_raw_rules(
+                raw_config.selected_codes, code_to_rule, category_to_rules
+            ),
+            ignored_rules=_parse_raw_rules(
+                raw_config.ignored_codes, code_to_rule, category_to_rules
+            ),
         )
 
-    @property
-    def all_rules(self) -> set[Rule]:
+    @cached_property
+    def all_rules(self) -> frozenset[Rule]:
         return self.selected_rules | self.ignored_rules
 
 
-def _parse_raw_rules(raw_codes: set[str], rules: set[Rule]) -> set[Rule]:
+def _group_by_category(code_to_rule: Mapping[str, Rule]) -> dict[str, list[Rule]]:
+    category_to_rules: defaultdict[str, list[Rule]] = defaultdict(list)
+    for rule in code_to_rule.values():
+        category_to_rules[rule.category].append(rule)
+    return category_to_rules
+
+
+def _parse_raw_rules(
+    raw_codes: set[str],
+    code_to_rule: Mapping[str, Rule],
+    category_to_rules: Mapping[str, list[Rule]],
+) -> frozenset[Rule]:
     """
     Convert code values (E401), categories (E) and ALL, into Rule objects
     """
     if "ALL" in raw_codes:
-        return rules
-
-    code_to_rule = {rule.code: rule for rule in rules}
+        return frozenset(code_to_rule.values())
 
     result: set[Rule] = set()
 
     for code in raw_codes:
         if code.isalpha() or len(code) < MIN_RULE_CODE_LEN:
-            code_rules = tuple(
-                rule for rule in rules if rule.code.removeprefix(code).isnumeric()
+            category_rules = category_to_rules.get(extract_category_prefix(code), ())
+            code_rules = (
+                tuple(category_rules)
+                if code.isalpha()
+                else tuple(  # a partial code, e.g. E1, only matches rules of its category
+                    rule for rule in category_rules if rule.code.startswith(code)
+                )
             )
             logger.debug(
                 f"assuming {code} is a category, adding {len(code_rules)} rules: {sorted(r.code for r in code_rules)!s}"
@@ -108,4 +172,4 @@ def _parse_raw_rules(raw_codes: set[str], rules: set[Rule]) -> set[Rule]:
 
     logger.debug(f"converted {len(raw_codes)} raw codes into {len(result)} rules")
 
-    return result
+    return frozenset(result)
@@ -1,26 +1,36 @@
 from __future__ import annotations
 
-from pydantic import BaseModel
+from typing import Any
 
+from pydantic.dataclasses import dataclass
 
-class Location(BaseModel):
+RawViolation = dict[str, Any]  # a single item of ruff's JSON output, not yet validated
+
+# The models below are slotted dataclasses (no per-instance __dict__), as there can be many violations
+
+
+@dataclass(frozen=True, slots=True)
+class Location:
     column: int
     row: int
 
 
-class Edit(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Edit:
     content: str
     end_location: Location
     location: Location
 
 
-class Fix(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Fix:
     applicability: str
     edits: tuple[Edit, ...]
     message: str | None
 
 
-class Violation(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Violation:
     cell: None  # TODO handle notebook output
     code: str
     end_location: Location
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Any, Literal
+from functools import cached_property
+from typing import Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+from adopt_ruff.utils import extract_category_prefix
 
 
 class FixAvailability(Enum):
@@ -24,10 +27,11 @@ class FixAvailability(Enum):
                 raise ValueError
 
 
+FIXABLE = frozenset({FixAvailability.ALWAYS, FixAvailability.SOMETIMES})
+
+
 class Rule(BaseModel):
-    class Config:
-        frozen = True
-        use_enum_values: Literal[True]
+    model_config = ConfigDict(frozen=True)
 
     name: str
     code: str
@@ -38,6 +42,23 @@ class Rule(BaseModel):
     explanation: str
     preview: bool
 
+    def __hash__(self) -> int:
+        # codes are unique, no need to hash the (long) explanation and other fields
+        return hash(self.code)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Rule):
+            return NotImplemented
+        return self.code == other.code
+
+    @cached_property
+    def category(self) -> str:
+        """
+        The letters the code starts with, e.g. PLR for PLR0913
+        """
+        return extract_category_prefix(self.code)
+
+    @cached_property
     def as_dict(self) -> dict[str, Any]:
         return {
             "Code": self.code,
@@ -49,4 +70,4 @@ class Rule(BaseModel):
 
     @property
     def is_fixable(self):
-        return self.fix in {FixAvailability.ALWAYS, FixAvailability.SOMETIMES}
+        return self.fix in FIXABLE
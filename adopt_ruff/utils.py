@@ -1,14 +1,47 @@
 import csv
-from collections.abc import Iterable
+import hashlib
+import os
+import string
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import Executor, Future
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
 
 from loguru import logger
-from mdutils.mdutils import MdUtils
-from tabulate import tabulate
 
-(ARTIFACTS_PATH := Path("artifacts")).mkdir(exist_ok=True)
+ARTIFACTS_PATH = Path("artifacts")  # created by main, not on import
 
-logger.add((ARTIFACTS_PATH / "adopt-ruff.log"), level="DEBUG")
+# hidden, so it isn't uploaded with the artifacts
+CACHE_PATH = ARTIFACTS_PATH / ".cache"
+
+WRITE_BUFFER_SIZE = 1 << 20  # write each output file with (ideally) a single syscall
+
+RULE_DOCS_URL = "https://docs.astral.sh/ruff/rules/"
+
+CONFIG_FILE_NAMES = ("pyproject.toml", "ruff.toml", ".ruff.toml")
+
+
+def md_header(level: int, title: str) -> str:
+    return f"\n{'#' * level} {title}\n"
+
+
+def md_line(text: str) -> str:
+    return f"\n{text}"
+
+
+def md_table(headers: Iterable[str], rows: Iterable[Iterable]) -> str:
+    """
+    Creates a Github-flavored markdown table. Columns aren't padded, Github aligns them when rendering.
+    """
+    header_cells = tuple(headers)
+    return "\n".join(
+        (
+            f"| {' | '.join(header_cells)} |",
+            f"|{'|'.join('---' for _ in header_cells)}|",
+            *(f"| {' | '.join(map(str, row))} |" for row in rows),
+        )
+    )
 
 
 def make_collapsible(content: str, summary: str) -> str:
@@ -21,61 +54,125 @@ def make_collapsible(content: str, summary: str) -> str:
 """
 
 
-def table_to_csv(items: list[dict], path: Path) -> None:
+def table_to_csv(items: Sequence[dict], path: Path) -> None:
     if not items:
         logger.warning(f"no items to write to {path.name}, skipping")
         return
 
-    if len(items) > 1 and not all(
-        # assert all keys are in the same order
-        item.keys() == items[0].keys()
-        for item in items[1:]
-    ):
-        raise ValueError("All table row keys must be identical, and in the same order")
+    # Values are picked by key, so only the keys themselves must match.
+    # The rows are built from the same dicts, so this is only checked in debug runs (not under -O)
+    if __debug__ and not all(item.keys() == items[0].keys() for item in items[1:]):
+        raise ValueError("All table row keys must be identical")
 
-    with path.open("w") as f:
+    keys = tuple(items[0].keys())
+    with path.open("w", newline="", buffering=WRITE_BUFFER_SIZE) as f:
         writer = csv.writer(f)
-        writer.writerow(items[0].keys())  # Headers
-        writer.writerows(item.values() for item in items)
+        writer.writerow(keys)  # Headers
+        # unlike DictWriter, which checks every row's keys in Python, itemgetter picks the values in C
+        writer.writerows(map(itemgetter(*keys), items))
 
     logger.debug(f"wrote {len(items)} to {path.absolute()!s}")
 
 
 def output_table(
-    items: Iterable[dict],
+    items: Sequence[dict],
     path: Path,
-    md: MdUtils,
+    md: list[str],
+    csv_writer: Executor,
     collapsible: bool,
     collapsible_summary: str = "Details",
-) -> None:
+) -> Future[None]:
     """
-    Creates a markdown table, and saves to a CSV
+    Creates a markdown table, and saves to a CSV using `csv_writer`.
+    Both read `items`, so it must be a sequence (rather than any iterable); it isn't copied.
     """
+    csv_written = csv_writer.submit(table_to_csv, items, path)
 
-    md_table = tabulate(
-        [make_name_clickable(item) for item in items],
-        tablefmt="github",
-        headers="keys",
-    )
+    headers = tuple(items[0].keys())
+    # picked by key like in table_to_csv, so rows with differently ordered keys line up
+    rows: Iterable[Iterable] = map(itemgetter(*headers), items)
+    if "Name" in headers:
+        name_index = headers.index("Name")
+        rows = (make_name_clickable(row, name_index) for row in rows)
+    table = md_table(headers, rows)
 
     if collapsible:
-        md_table = make_collapsible(md_table, summary=collapsible_summary)
+        table = make_collapsible(table, summary=collapsible_summary)
+
+    md.append(md_line(table))
+    return csv_written
 
-    md.new_line(md_table)
-    table_to_csv(list(items), path)
 
+def make_name_clickable(values: Iterable, name_index: int) -> list:
+    """
+    Returns a copy of a row's values, with the rule name linked to its docs.
+    The row itself is left as is, as it's also written to CSV (and may be a cached Rule.as_dict)
+    """
+    row = list(values)
+    if name := row[name_index]:
+        row[name_index] = f"[{name}]({RULE_DOCS_URL}{name})"
+    return row
+
+
+def find_config_files(directories: Iterable[Path]) -> list[Path]:
+    """
+    Returns the config file paths ruff may read for files in `directories`, existing or not:
+    those in the directories themselves, and in every parent directory.
+    """
+    all_directories: set[Path] = set()
+    for directory in directories:
+        resolved = directory.resolve()
+        all_directories.update((resolved, *resolved.parents))
+    return [
+        directory / name
+        for directory in sorted(all_directories)
+        for name in CONFIG_FILE_NAMES
+    ]
+
+
+def user_config_files() -> Iterator[Path]:
+    """
+    Yields the paths of ruff's user-level config (used when a project has none), existing or not.
+    """
+    config_dirs = [Path(os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config")]
+    if app_data := os.environ.get("APPDATA"):  # Windows
+        config_dirs.append(Path(app_data))
+    config_dirs.append(Path.home() / "Library" / "Application Support")  # macOS
+
+    for config_dir in config_dirs:
+        for name in CONFIG_FILE_NAMES:
+            yield config_dir / "ruff" / name
 
-def make_name_clickable(item: dict) -> dict:
-    if not (name := item.get("Name")):
-        return item
-    return item | {"Name": f"[{name}](https://docs.astral.sh/ruff/rules/{name})"}
+
+def fingerprint(files: Iterable[Path], *extra: str) -> str:
+    """
+    Hashes the paths, modification times and sizes of `files` (skipping missing ones),
+    along with any `extra` values. Changes to any of those change the fingerprint.
+    """
+    digest = hashlib.sha256("\0".join(extra).encode())
+    for file_path in files:
+        try:
+            stat = file_path.stat()
+        # doesn't exist, or is a dangling symlink (which ruff skips as well)
+        except OSError:
+            continue
+        digest.update(f"{file_path}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=1024)  # a few hundred distinct codes, looked up repeatedly
+def extract_category_prefix(code: str) -> str:
+    """
+    Returns the letters a rule code starts with, e.g. PLR for PLR0913
+    """
+    return code[: len(code) - len(code.lstrip(string.ascii_uppercase))] or code
 
 
 def search_config_file(path: Path) -> Path | None:
     """
     Searches for common configuration files under the given directory.
     """
-    for name in ("pyproject.toml", "ruff.toml", ".ruff.toml"):
+    for name in CONFIG_FILE_NAMES:
         if (file_path := path / name).exists():
             logger.info(f"found config file at {file_path.resolve()!s}")
             return file_path